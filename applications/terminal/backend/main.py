@@ -1,16 +1,22 @@
 from fastapi import FastAPI, HTTPException, Request, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, Response
 from pydantic import BaseModel, field_validator
 from typing import Optional
+import asyncio
+import contextlib
+import functools
 import os
-import subprocess
 import logging
 import re
-import requests
+import string
+import httpx
+import orjson
+from cachetools import TTLCache
 from datetime import datetime
-from database import init_db
+from urllib.parse import quote
+from database import engine, init_db, history_flusher
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -25,8 +31,45 @@ enable_docs = os.getenv("ENABLE_DOCS", "false").lower() == "true"
 # Set to "false" to show generic errors (production)
 show_detailed_errors = os.getenv("SHOW_DETAILED_ERRORS", "false").lower() == "true"
 
+def _find_git_dir(path: str) -> Optional[str]:
+    """Return the .git directory of the checkout containing path, or None if there is none
+
+    Stops at the first .git entry: a .git file (worktree or submodule) is not
+    followed, and the walk does not continue into an enclosing repository.
+    """
+    path = os.path.abspath(path)
+    while True:
+        git_dir = os.path.join(path, ".git")
+        if os.path.exists(git_dir):
+            return git_dir if os.path.isdir(git_dir) else None
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+def _git_head_commit(git_dir: str) -> Optional[str]:
+    """Resolve HEAD to its short commit hash through the loose ref file or packed-refs"""
+    with open(os.path.join(git_dir, "HEAD"), "r") as f:
+        head = f.read().strip()
+    if not head.startswith("ref: "):
+        return head[:7]  # detached HEAD
+    ref = head[len("ref: "):]
+    try:
+        with open(os.path.join(git_dir, ref), "r") as f:
+            return f.read().strip()[:7]
+    except FileNotFoundError:
+        pass
+    with open(os.path.join(git_dir, "packed-refs"), "r") as f:
+        for line in f:
+            sha, _, name = line.strip().partition(" ")
+            if name == ref:
+                return sha[:7]
+    return None
+
 # Get version from environment variable, build arg, or default
 # Priority: 1. API_VERSION env var, 2. Build-time VERSION file, 3. Default
+# Cached so the lookup (and the git fallback) runs at most once per process
+@functools.lru_cache(maxsize=1)
 def get_version():
     # Try environment variable first (can be set at runtime or build time)
     version = os.getenv("API_VERSION")
@@ -44,43 +87,75 @@ def get_version():
     except Exception:
         pass
     
-    # Try to get version from git tag (for local development)
-    try:
-        result = subprocess.run(
-            ["git", "describe", "--tags", "--always"],
-            capture_output=True,
-            text=True,
-            timeout=1,
-            cwd=os.path.dirname(__file__)
-        )
-        if result.returncode == 0:
-            return result.stdout.strip()
-    except (subprocess.TimeoutExpired, FileNotFoundError, subprocess.SubprocessError):
-        pass
+    # Try to get the current git commit (for local development)
+    # Read straight from the .git files - no git subprocess. Containers have no .git.
+    git_dir = _find_git_dir(os.path.dirname(__file__))
+    if git_dir is not None:
+        try:
+            version = _git_head_commit(git_dir)
+            if version:
+                return version
+        except OSError:
+            pass
     
     # Default version
     return "1.0.0"
 
 api_version = get_version()
 
+# Startup: initialize database, HTTP client and history flusher
+# Shutdown: flush queued command history, close DB connections and the HTTP client
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    await init_db()
+    async with httpx.AsyncClient(
+        timeout=WTTR_TIMEOUT,
+        follow_redirects=True,  # like requests.get, which this client replaced
+        # Pool limits go on the transport: the client ignores limits= when
+        # a transport is passed explicitly
+        transport=httpx.AsyncHTTPTransport(
+            retries=1,
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=10),
+        ),
+    ) as http:
+        app.state.http = http
+        flusher = asyncio.create_task(history_flusher())
+        try:
+            yield
+        finally:
+            flusher.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await flusher
+            await engine.dispose()
+
 # Create main FastAPI app
 app = FastAPI(
     title="Terminal API",
     version=api_version,
+    lifespan=lifespan,
     docs_url="/docs" if enable_docs else None,
     redoc_url="/redoc" if enable_docs else None,
     openapi_url="/openapi.json" if enable_docs else None,
+    default_response_class=ORJSONResponse,  # orjson is considerably faster than the stdlib encoder
 )
 
 # CORS middleware
+# No credentials with a wildcard origin (browsers reject that combination anyway)
+# and explicit methods/headers, so preflight responses are static
 cors_config = {
     "allow_origins": ["*"],  # In production, specify your frontend domain
-    "allow_credentials": True,
-    "allow_methods": ["*"],
-    "allow_headers": ["*"],
+    "allow_credentials": False,
+    "allow_methods": ["GET", "POST", "OPTIONS"],
+    "allow_headers": ["Content-Type"],
 }
 app.add_middleware(CORSMiddleware, **cors_config)
 
+# Generic (production) error bodies, encoded once
+_INVALID_INPUT_BODY = b'{"detail":"Invalid input provided"}'
+_INVALID_REQUEST_BODY = b'{"detail":"Invalid request"}'
+_INTERNAL_ERROR_BODY = b'{"detail":"Internal server error"}'
+_GENERIC_ERROR_BODY = b'{"detail":"An error occurred"}'
+
 # Custom exception handler to sanitize error messages for security
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
@@ -93,10 +168,11 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
         )
     else:
         # Production mode: show generic error
-        logger.warning(f"Validation error from {request.client.host}: {exc.errors()}")
-        return JSONResponse(
+        logger.warning("Validation error from %s: %s", request.client.host, exc.errors())
+        return Response(
+            content=_INVALID_INPUT_BODY,
             status_code=status.HTTP_400_BAD_REQUEST,
-            content={"detail": "Invalid input provided"}
+            media_type="application/json"
         )
 
 @app.exception_handler(HTTPException)
@@ -110,27 +186,27 @@ async def http_exception_handler(request: Request, exc: HTTPException):
         )
     else:
         # Production mode: show generic error based on status code
-        logger.warning(f"HTTP {exc.status_code} from {request.client.host}: {exc.detail}")
+        logger.warning("HTTP %s from %s: %s", exc.status_code, request.client.host, exc.detail)
         if exc.status_code == 400:
-            return JSONResponse(
-                status_code=400,
-                content={"detail": "Invalid request"}
-            )
+            body = _INVALID_REQUEST_BODY
         elif exc.status_code == 500:
-            return JSONResponse(
-                status_code=500,
-                content={"detail": "Internal server error"}
-            )
+            body = _INTERNAL_ERROR_BODY
         else:
-            return JSONResponse(
-                status_code=exc.status_code,
-                content={"detail": "An error occurred"}
-            )
+            body = _GENERIC_ERROR_BODY
+        return Response(content=body, status_code=exc.status_code, media_type="application/json")
 
-# Initialize database on startup
-@app.on_event("startup")
-async def startup_event():
-    init_db()
+# Deletes every allowed session_id character; anything left over is invalid.
+# str.translate is a single C-level pass, no regex engine needed.
+_SESSION_ID_INVALID = str.maketrans("", "", string.ascii_letters + string.digits + "_.-")
+
+# Patterns compiled once at import (\Z, unlike $, rejects a trailing newline)
+_LOCATION_RE = re.compile(r'^[a-zA-Z0-9\s,-]+\Z')
+_ANSI_RE = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
+# wttr.in promotional lines (matched after ANSI stripping, the handle is colored)
+_PROMO_RE = re.compile(
+    r'Follow @igor_chubin for wttr\.in updates'
+    r'|If you like wttr\.in, you can donate here: https://wttr\.in/donate'
+)
 
 class CommandRequest(BaseModel):
     command: str
@@ -146,7 +222,7 @@ class CommandRequest(BaseModel):
         if len(v) > 100:
             raise ValueError("session_id must be 100 characters or less")
         # Allow alphanumeric, underscore, hyphen, and dot (for session_ prefix)
-        if not re.match(r'^[a-zA-Z0-9_.-]+$', v):
+        if v.translate(_SESSION_ID_INVALID):
             raise ValueError("session_id contains invalid characters")
         return v
     
@@ -162,6 +238,24 @@ class CommandResponse(BaseModel):
     output: str
     error: Optional[str] = None
 
+# wttr.in is called through a shared httpx.AsyncClient (app.state.http, created
+# in lifespan): pooled keep-alive connections, and the event loop keeps serving
+# other requests while a weather lookup is in flight. A failed connect is
+# retried once (e.g. a pooled connection closed by the server); reads are not.
+WTTR_TIMEOUT = 10.0  # seconds
+WTTR_MAX_BYTES = 32768  # a full forecast is ~10 kB including ANSI codes
+_WTTR_HEADERS = {
+    "User-Agent": "curl/7.68.0"  # wttr.in prefers curl user agent
+}
+
+# Weather changes slowly: successful lookups are cached per location
+# (case-insensitive) for 5 minutes, errors are not cached
+WEATHER_CACHE_TTL = 300  # seconds
+_weather_cache = TTLCache(maxsize=256, ttl=WEATHER_CACHE_TTL)
+# In-flight fetches by location key: concurrent misses share one request and
+# its result, errors included (so a failing wttr.in costs every caller one timeout)
+_weather_fetches: dict = {}
+
 async def get_weather(location: Optional[str] = None) -> str:
     """
     Fetch weather from wttr.in API.
@@ -186,46 +280,114 @@ async def get_weather(location: Optional[str] = None) -> str:
     if len(location) > 100:
         return "Error: Location name is too long (max 100 characters)."
     
-    if not re.match(r'^[a-zA-Z0-9\s,-]+$', location):
+    if not _LOCATION_RE.match(location):
         return "Error: Invalid location. Only letters, numbers, spaces, hyphens, and commas are allowed."
     
+    key = location.lower()
+    cached = _weather_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    fetch = _weather_fetches.get(key)
+    if fetch is None:
+        fetch = asyncio.create_task(_fetch_weather(location, key))
+        _weather_fetches[key] = fetch
+        fetch.add_done_callback(lambda done: _weather_fetches.pop(key, None))
+    # Shielded so a cancelled caller does not abort the fetch for the others
+    return await asyncio.shield(fetch)
+
+async def _fetch_weather(location: str, key: str) -> str:
+    """Fetch and clean wttr.in output for a validated location, caching successful results"""
     try:
         # Call wttr.in API with ?A flag to disable ANSI colors (but we'll still clean them)
         # Using format=1 for plain text, or format=2 for minimal output
         # We'll use the default format and clean ANSI codes ourselves
-        url = f"https://wttr.in/{location}?A"
+        # Location is percent-encoded as a single path segment (commas are valid as-is)
+        url = "https://wttr.in/" + quote(location, safe=",") + "?A"
         
-        # Set timeout and user agent
-        headers = {
-            "User-Agent": "curl/7.68.0"  # wttr.in prefers curl user agent
-        }
-        
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
+        # Stream the body and stop at WTTR_MAX_BYTES; wttr.in always sends UTF-8
+        body = bytearray()
+        async with app.state.http.stream("GET", url, headers=_WTTR_HEADERS) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes():
+                body += chunk
+                if len(body) >= WTTR_MAX_BYTES:
+                    break
+        text = body[:WTTR_MAX_BYTES].decode("utf-8", errors="replace")
         
         # Clean ANSI escape codes
-        ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-        clean_output = ansi_escape.sub('', response.text)
+        clean_output = _ANSI_RE.sub('', text)
         
         # Remove promotional text
-        clean_output = clean_output.replace("Follow @igor_chubin for wttr.in updates", "")
-        clean_output = clean_output.replace("If you like wttr.in, you can donate here: https://wttr.in/donate", "")
+        clean_output = _PROMO_RE.sub('', clean_output)
         
         # Clean up any extra whitespace
         clean_output = clean_output.strip()
         
+        _weather_cache[key] = clean_output
         return clean_output
         
-    except requests.exceptions.Timeout:
-        logger.error(f"Weather API timeout for location: {location}")
+    except httpx.TimeoutException:
+        logger.error("Weather API timeout for location: %s", location)
         return "Error: Weather service timeout. Please try again later."
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Weather API error for location '{location}': {e}")
+    except httpx.HTTPError as e:
+        logger.error("Weather API error for location '%s': %s", location, e)
         return "Error: Unable to fetch weather data. Please check the location and try again."
     except Exception as e:
-        logger.error(f"Unexpected error fetching weather for '{location}': {e}", exc_info=True)
+        logger.error("Unexpected error fetching weather for '%s': %s", location, e, exc_info=True)
         return "Error: Unable to fetch weather data. Please try again later."
 
+# Simulated commands with a fixed output (exact match)
+_EXACT = {
+    "uptime": "up 1 day, 2:30:45, 1 user, load average: 0.15, 0.12, 0.10",
+    "uname -a": "Linux terminal 5.15.0-91-generic #101-Ubuntu SMP x86_64 GNU/Linux",
+    "df -h": """Filesystem      Size  Used Avail Use% Mounted on
+/dev/sda1        20G  5.2G   14G  28% /
+tmpfs           2.0G     0  2.0G   0% /dev/shm""",
+    "free -h": """              total        used        free      shared  buff/cache   available
+Mem:           2.0G        512M        1.2G         32M        256M        1.4G
+Swap:          2.0G          0B        2.0G""",
+    "ps aux": """USER       PID %CPU %MEM    VSZ   RSS TTY      STAT START   TIME COMMAND
+root         1  0.0  0.1  12345  1234 ?        Ss   10:00   0:01 /sbin/init
+web-user  1234  0.1  0.2  23456  2345 ?        S    10:05   0:02 node server.js""",
+}
+
+# Fixed-output commands have a deterministic response, so the JSON body is
+# serialized once at import and returned without building a CommandResponse
+_CANNED = {
+    command: orjson.dumps({"output": output, "error": None})
+    for command, output in _EXACT.items()
+}
+# Body for an empty (or whitespace-only) command. Only the bytes are shared:
+# a Response instance must not be reused, middleware mutates its headers.
+_EMPTY_BODY = b'{"output":"","error":null}'
+
+# Simulated commands taking arguments, keyed by command name. Handlers get the
+# argument string after the name ("" if none) and return (output, error).
+async def _handle_ping(args: str) -> tuple:
+    host = args.split(None, 1)[0] if args else "localhost"
+    return f"PING {host} (127.0.0.1): 56 data bytes\n64 bytes from 127.0.0.1: icmp_seq=0 ttl=64 time=0.123 ms", None
+
+async def _handle_cat(args: str) -> tuple:
+    filename = args.split(None, 1)[0] if args else ""
+    if filename:
+        return f"# Contents of {filename}\nThis is a simulated file content.\nLine 1\nLine 2\nLine 3", None
+    return "", "cat: missing file operand"
+
+async def _handle_grep(args: str) -> tuple:
+    return "grep: simulated search results", None
+
+async def _handle_weather(args: str) -> tuple:
+    # Everything after the command name is the location (e.g., "weather New York")
+    return await get_weather(args or None), None
+
+_HANDLERS = {
+    "ping": _handle_ping,
+    "cat": _handle_cat,
+    "grep": _handle_grep,
+    "weather": _handle_weather,
+}
+
 # Root level endpoints
 @app.get("/")
 async def root():
@@ -249,10 +411,14 @@ async def execute_command(request: CommandRequest):
     """
     # Command is already validated and stripped by Pydantic validator
     command = request.command
-    logger.info(f"Execute endpoint called with command: {command}")
-    
     if not command:
-        return CommandResponse(output="")
+        return Response(content=_EMPTY_BODY, media_type="application/json")
+    
+    # Lazy %-formatting: the message is only formatted if a handler emits it
+    logger.info("Execute endpoint called with command: %s", command)
+    
+    if command in _CANNED:
+        return Response(content=_CANNED[command], media_type="application/json")
     
     # Safe command execution - only allow specific commands
     output = ""
@@ -260,37 +426,10 @@ async def execute_command(request: CommandRequest):
     
     try:
         # Simulate command execution
-        if command.startswith("ping "):
-            host = command.split()[1] if len(command.split()) > 1 else "localhost"
-            output = f"PING {host} (127.0.0.1): 56 data bytes\n64 bytes from 127.0.0.1: icmp_seq=0 ttl=64 time=0.123 ms"
-        elif command == "uptime":
-            output = "up 1 day, 2:30:45, 1 user, load average: 0.15, 0.12, 0.10"
-        elif command == "uname -a":
-            output = "Linux terminal 5.15.0-91-generic #101-Ubuntu SMP x86_64 GNU/Linux"
-        elif command.startswith("cat "):
-            filename = command.split()[1] if len(command.split()) > 1 else ""
-            if filename:
-                output = f"# Contents of {filename}\nThis is a simulated file content.\nLine 1\nLine 2\nLine 3"
-            else:
-                error = "cat: missing file operand"
-        elif command == "df -h":
-            output = """Filesystem      Size  Used Avail Use% Mounted on
-/dev/sda1        20G  5.2G   14G  28% /
-tmpfs           2.0G     0  2.0G   0% /dev/shm"""
-        elif command == "free -h":
-            output = """              total        used        free      shared  buff/cache   available
-Mem:           2.0G        512M        1.2G         32M        256M        1.4G
-Swap:          2.0G          0B        2.0G"""
-        elif command.startswith("grep "):
-            output = "grep: simulated search results"
-        elif command == "ps aux":
-            output = """USER       PID %CPU %MEM    VSZ   RSS TTY      STAT START   TIME COMMAND
-root         1  0.0  0.1  12345  1234 ?        Ss   10:00   0:01 /sbin/init
-web-user  1234  0.1  0.2  23456  2345 ?        S    10:05   0:02 node server.js"""
-        elif command.startswith("weather"):
-            # Extract location from command (e.g., "weather London" -> "London")
-            location = command.split(" ", 1)[1] if len(command.split()) > 1 else None
-            output = await get_weather(location)
+        name, _, args = command.partition(" ")
+        handler = _HANDLERS.get(name)
+        if handler:
+            output, error = await handler(args)
         else:
             # For unknown commands, just return a message
             output = f"Command '{command}' executed successfully"